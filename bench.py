@@ -0,0 +1,400 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2015 Kenneth Benzie
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from __future__ import print_function
+from os import path
+from generate import Generator, Variable, is_identifier, replace_stub_prefix
+import schema as Schema
+import copy
+import getopt
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+include_pattern = re.compile(r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.M)
+
+
+class EntryPoint:
+    def __init__(self, context, node):
+        self.node = node
+        self.name = context.replace_prefix(
+                replace_stub_prefix(node.text.strip(), context.stub_prefix))
+        self.return_type = context.replace_prefix(
+                node.find('return').text.strip())
+        self.params = []
+        for param in node.findall('param'):
+            if None != param.text:
+                self.params.append(context.replace_prefix(
+                    param.find('type').text.strip()))
+        # The backends are whatever the expanded stub body calls with the
+        # entry point's arguments forwarded unchanged.
+        arguments = [param.text for param in node.findall('param')
+                if None != param.text]
+        body = context.replace_stub(context.stub.text,
+                replace_stub_prefix(node.text.strip()), arguments)
+        call = re.compile(r'\b([A-Za-z_]\w*)\s*\(\s*' +
+                re.escape(', '.join(arguments)) + r'\s*\)')
+        self.backends = []
+        for backend in call.findall(body):
+            if not backend in self.backends:
+                self.backends.append(backend)
+
+    def declaration(self, generator, name):
+        node = copy.deepcopy(self.node)
+        node.text = name
+        return generator.function(node, False, False, False)
+
+    def arguments(self):
+        return ', '.join(['arg' + str(index)
+            for index in range(len(self.params))])
+
+
+# Follows the stub mode traversal of Generator.generate() with guards off, only
+# functions which are direct children of a guard are emitted as stubs.
+def entry_points(context, parent):
+    functions = []
+    for node in parent:
+        if 'guard' == node.tag:
+            functions.extend([EntryPoint(context, guard_node)
+                for guard_node in node if is_entry_point(guard_node)])
+        elif 'scope' == node.tag:
+            functions.extend(entry_points(context, node))
+        elif is_entry_point(node):
+            functions.append(EntryPoint(context, node))
+    return functions
+
+
+def is_entry_point(node):
+    return 'function' == node.tag and None == node.attrib.get('form')
+
+
+def backends_header(header, entries, plain):
+    source = '#ifndef BENCH_BACKENDS_H_INCLUDED\n'
+    source += '#define BENCH_BACKENDS_H_INCLUDED\n\n'
+    source += '#include <' + header + '>\n\n'
+    for entry in entries:
+        for backend in entry.backends:
+            source += entry.declaration(plain, backend) + ';\n'
+    return source + '\n#endif  // BENCH_BACKENDS_H_INCLUDED\n'
+
+
+def backends_source(entries, plain):
+    source = '#include "backends.h"\n\n'
+    for entry in entries:
+        for backend in entry.backends:
+            source += entry.declaration(plain, backend) + ' {\n'
+            if 'void' != entry.return_type:
+                source += '  static ' + entry.return_type + ' result;\n'
+                source += '  return result;\n'
+            source += '}\n\n'
+    return source
+
+
+def bench_source(entries):
+    source = '#define _POSIX_C_SOURCE 199309L\n'
+    source += '#include <stdio.h>\n'
+    source += '#include <stdlib.h>\n'
+    source += '#include <time.h>\n'
+    source += '#include "backends.h"\n\n'
+    source += 'static double now(void) {\n'
+    source += '  struct timespec time;\n'
+    source += '  clock_gettime(CLOCK_MONOTONIC, &time);\n'
+    source += '  return time.tv_sec * 1e9 + time.tv_nsec;\n'
+    source += '}\n\n'
+    source += 'int main(int argc, char **argv) {\n'
+    source += '  long iterations = 2 == argc ? atol(argv[1]) : 1000000;\n'
+    source += '  long index;\n'
+    source += '  double start;\n'
+    for entry in entries:
+        arguments = entry.arguments()
+        source += '  {\n'
+        for index, type in enumerate(entry.params):
+            source += '    static ' + type + ' arg' + str(index) + ';\n'
+        source += '    start = now();\n'
+        source += '    for (index = 0; index < iterations; index++) {\n'
+        source += '      ' + entry.name + '(' + arguments + ');\n'
+        source += '    }\n'
+        source += '    printf("' + entry.name + ' stub %f\\n", ' + \
+                '(now() - start) / iterations);\n'
+        source += '    start = now();\n'
+        source += '    for (index = 0; index < iterations; index++) {\n'
+        for backend in entry.backends:
+            source += '      ' + backend + '(' + arguments + ');\n'
+        source += '    }\n'
+        source += '    printf("' + entry.name + ' direct %f\\n", ' + \
+                '(now() - start) / iterations);\n'
+        source += '  }\n'
+    return source + '  return 0;\n}\n'
+
+
+def run(command, cwd):
+    process = subprocess.Popen(command, cwd = cwd, stdout = subprocess.PIPE,
+            stderr = subprocess.STDOUT)
+    output = process.communicate()[0].decode('utf-8', 'replace')
+    if 0 != process.returncode:
+        raise Exception('command failed: ' + ' '.join(command) + '\n' + output)
+    return output
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def parse_time(compiler, flags, source, cwd, repeat):
+    command = compiler + flags + ['-fsyntax-only', '-x', 'c', source]
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        run(command, cwd)
+        times.append((time.time() - start) * 1000.0)
+    return median(times)
+
+
+def object_sizes(filename, cwd):
+    sizes = {'bytes': path.getsize(filename)}
+    if None != find_program('size'):
+        lines = run(['size', filename], cwd).strip().split('\n')
+        text, data, bss = lines[-1].split()[:3]
+        sizes.update({'text': int(text), 'data': int(data), 'bss': int(bss)})
+    symbols = {}
+    if None != find_program('nm'):
+        for line in run(['nm', '-S', '--defined-only', filename],
+                cwd).split('\n'):
+            fields = line.split()
+            if 4 == len(fields):
+                symbols[fields[3]] = int(fields[1], 16)
+    return sizes, symbols
+
+
+def find_program(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        program = path.join(directory, name)
+        if path.isfile(program) and os.access(program, os.X_OK):
+            return program
+    return None
+
+
+def resolves(compiler, include, cwd):
+    source = path.join(cwd, 'resolve.c')
+    with open(source, 'w') as output:
+        output.write('#include <' + include + '>\n')
+    try:
+        run(compiler + ['-E', '-x', 'c', source], cwd)
+        return True
+    except Exception:
+        return False
+
+
+# Generate the header and stubs for the schema, build them against no-op
+# backends with the local C compiler and measure the header parse time, the
+# size of the stubs object and the per call latency each stub adds on top of
+# calling its backends directly. Stubs are always rendered without guards,
+# they share the header's include guard so would be compiled out.
+def benchmark(interface, generator, directory, compiler = None, flags = None,
+        iterations = 1000000, repeat = 5):
+    if '' == generator.prefix:
+        raise Exception('a prefix is required to locate the stubs header')
+    if None == generator.stub_name:
+        raise Exception('a stub is required to benchmark')
+    if None == compiler:
+        compiler = os.environ.get('CC', 'cc').split()
+    if None == flags:
+        flags = os.environ.get('CFLAGS', '-O2').split()
+    generator = copy.copy(generator)
+    generator.stub_guards_on = False
+    context = generator.bind(interface)
+    if context.stub_qualifier and 'static' in context.stub_qualifier.split():
+        raise Exception('static stubs can not be called by the benchmark')
+    plain = Generator(prefix = generator.prefix, indent = generator.indent)
+
+    header = context.replace_prefix('${prefix}/${prefix}.h')
+    header_text = plain.render(interface)
+    stubs_text = '#include "backends.h"\n\n' + generator.render(interface)
+    entries = entry_points(context, interface)
+
+    include = path.join(directory, 'include')
+    if not path.isdir(path.join(include, path.dirname(header))):
+        os.makedirs(path.join(include, path.dirname(header)))
+    files = {
+        path.join(include, header): header_text,
+        path.join(directory, 'stubs.c'): stubs_text,
+        path.join(directory, 'backends.h'): backends_header(header, entries,
+            plain),
+        path.join(directory, 'backends.c'): backends_source(entries, plain),
+        path.join(directory, 'bench.c'): bench_source(entries),
+        path.join(directory, 'empty.h'): '',
+    }
+    for filename, text in files.items():
+        with open(filename, 'w') as output:
+            output.write(text)
+
+    # Includes which can not be found are replaced by empty headers, or by
+    # the backend declarations when only the stubs include them.
+    options = flags
+    flags = flags + ['-I', include, '-I', directory]
+    header_includes = include_pattern.findall(header_text)
+    for name in set(header_includes + include_pattern.findall(stubs_text)):
+        if name == header or resolves(compiler + flags, name, directory):
+            continue
+        shim = path.join(include, name)
+        if not path.isdir(path.dirname(shim)):
+            os.makedirs(path.dirname(shim))
+        with open(shim, 'w') as output:
+            if not name in header_includes:
+                output.write('#include "backends.h"\n')
+
+    parse = parse_time(compiler, flags, path.join(include, header), directory,
+            repeat)
+    baseline = parse_time(compiler, flags, path.join(directory, 'empty.h'),
+            directory, repeat)
+
+    objects = []
+    for name in ['stubs', 'backends', 'bench']:
+        run(compiler + flags + ['-c', name + '.c', '-o', name + '.o'],
+                directory)
+        objects.append(name + '.o')
+    run(compiler + flags + objects + ['-o', 'bench'], directory)
+    sizes, symbols = object_sizes(path.join(directory, 'stubs.o'), directory)
+
+    latency = {}
+    for line in run([path.join(directory, 'bench'), str(iterations)],
+            directory).strip().split('\n'):
+        name, kind, nanoseconds = line.split()
+        latency[(name, kind)] = float(nanoseconds)
+
+    results = {
+        'compiler': run(compiler + ['--version'], directory).split('\n')[0],
+        'flags': options,
+        'iterations': iterations,
+        'header': {
+            'name': header,
+            'bytes': len(header_text.encode('utf-8')),
+            'parse_ms': parse,
+            'baseline_ms': baseline,
+            'overhead_ms': parse - baseline,
+        },
+        'stubs': sizes,
+        'entry_points': [],
+    }
+    for entry in entries:
+        stub = latency[(entry.name, 'stub')]
+        direct = latency[(entry.name, 'direct')]
+        results['entry_points'].append({
+            'name': entry.name,
+            'backends': entry.backends,
+            'bytes': symbols.get(entry.name),
+            'stub_ns': stub,
+            'direct_ns': direct,
+            'overhead_ns': stub - direct,
+        })
+    return results
+
+
+def help():
+    print('bench.py [options] <schema>\n')
+    print('options:')
+    print('        -h                            show this help message')
+    print('        -p <prefix>                   identifier to be prefixed')
+    print('        -s <name>                     stub to benchmark')
+    print('        -v <variable>:<value>[;...]   add user variable')
+    print('        -n <iterations>               calls per entry point')
+    print('        -r <repeat>                   header parse repetitions')
+    print('        -k <directory>                keep the build directory')
+    print('        -o <file>                     write the results to a file')
+    print('\nstubs are built without guards, the CC and CFLAGS environment')
+    print('variables select the compiler')
+
+
+def main():
+    if 1 == len(sys.argv):
+        help()
+        sys.exit(1)
+
+    options, arguments = getopt.getopt(sys.argv[1:], 'hp:s:v:n:r:k:o:')
+
+    if ('-h', '') in options:
+        help()
+        sys.exit(0)
+
+    if 1 != len(arguments):
+        raise Exception('expected one schema file')
+    schema = arguments[0]
+    if not path.exists(schema) or not path.isfile(schema):
+        raise Exception('invalid schema file:', schema);
+
+    prefix = ''
+    stub = None
+    variables = []
+    iterations = 1000000
+    repeat = 5
+    keep = None
+    output = None
+
+    for opt, arg in options:
+        if opt in ('-p'):
+            if not is_identifier(arg):
+                raise Exception('invalid C prefix:', arg)
+            prefix = arg
+        elif opt in ('-s'):
+            stub = arg
+        elif opt in ('-v'):
+            name_end = str(arg).find(':')
+            variable = Variable(arg[0:name_end], arg[name_end + 1:].split(';'))
+            variables.append(variable)
+        elif opt in ('-n'):
+            iterations = int(arg)
+        elif opt in ('-r'):
+            repeat = int(arg)
+        elif opt in ('-k'):
+            keep = arg
+        elif opt in ('-o'):
+            output = arg
+
+    generator = Generator(prefix = prefix, stub = stub,
+            variables = variables)
+    directory = keep
+    if None == directory:
+        directory = tempfile.mkdtemp()
+    try:
+        results = benchmark(Schema.load(schema), generator, directory,
+                iterations = iterations, repeat = repeat)
+    finally:
+        if None == keep:
+            shutil.rmtree(directory)
+
+    text = json.dumps(results, indent = 2) + '\n'
+    if None == output:
+        sys.stdout.write(text)
+    else:
+        with open(output, 'w') as results_file:
+            results_file.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,535 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2015 Kenneth Benzie
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from __future__ import print_function
+from os import path
+import schema as Schema
+import xml.etree.ElementTree as XML
+import copy
+import getopt
+import heapq
+import re
+import sys
+
+
+# Tags which only group other tags, declarations are looked for inside these.
+containers = ['guard', 'scope', 'block']
+declarations = ['struct', 'union', 'enum', 'typedef', 'function']
+tags = ['struct', 'union', 'enum']
+keywords = ['void', 'char', 'short', 'int', 'long', 'float', 'double',
+        'signed', 'unsigned', '_Bool', 'const', 'volatile', 'restrict',
+        'static', 'extern', 'inline', 'register', 'auto', 'if', 'else',
+        'do', 'while', 'for', 'switch', 'case', 'default', 'break',
+        'continue', 'goto', 'return', 'sizeof', 'typedef', 'struct', 'union',
+        'enum', 'defined']
+# Identifiers which are not part of a number, e.g. 1u or 0xff, or a member.
+identifier = re.compile(
+        r'(?<![\w.])(?:\$\{\w+\}|[A-Za-z_])(?:\$\{\w+\}|\w)*')
+literals = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|'
+        r'/\*.*?\*/|//[^\n]*', re.S)
+bounds = re.compile(r'\[([^\]]*)\]')
+
+
+def integer_types(name):
+    names = []
+    for width in ['8', '16', '32', '64']:
+        for sign in ['', 'u']:
+            for form in ['int', 'int_least', 'int_fast']:
+                names.append(sign + form + width + '_t')
+                names.append(name % (sign.upper() + form.upper() + width))
+    return names
+
+
+# Identifiers provided by the standard headers, including struct, union and
+# enum tag names, used to find unused includes. Any other include must list
+# what it provides with the provides attribute, otherwise it is assumed to be
+# needed.
+standard = {
+    'assert.h': ['assert'],
+    'ctype.h': ['isalnum', 'isalpha', 'isdigit', 'islower', 'isspace',
+        'isupper', 'isxdigit', 'tolower', 'toupper'],
+    'errno.h': ['errno', 'EDOM', 'ERANGE', 'EILSEQ'],
+    'float.h': ['FLT_MAX', 'FLT_MIN', 'FLT_EPSILON', 'DBL_MAX', 'DBL_MIN',
+        'DBL_EPSILON'],
+    'inttypes.h': integer_types('PRI%s') + ['intmax_t', 'uintmax_t',
+        'intptr_t', 'uintptr_t', 'imaxabs', 'strtoimax', 'strtoumax'],
+    'limits.h': ['CHAR_BIT', 'CHAR_MAX', 'CHAR_MIN', 'INT_MAX', 'INT_MIN',
+        'LONG_MAX', 'LONG_MIN', 'SHRT_MAX', 'SHRT_MIN', 'UINT_MAX',
+        'ULONG_MAX', 'USHRT_MAX', 'SCHAR_MAX', 'SCHAR_MIN', 'UCHAR_MAX'],
+    'math.h': ['float_t', 'double_t', 'HUGE_VAL', 'INFINITY', 'NAN',
+        'fabs', 'floor', 'ceil', 'sqrt', 'pow', 'exp', 'log', 'sin', 'cos',
+        'tan'],
+    'locale.h': ['lconv', 'setlocale', 'localeconv', 'LC_ALL', 'LC_CTYPE',
+        'LC_NUMERIC'],
+    'setjmp.h': ['jmp_buf', 'setjmp', 'longjmp'],
+    'signal.h': ['sig_atomic_t', 'signal', 'raise', 'SIGABRT', 'SIGINT'],
+    'stdarg.h': ['va_list', 'va_start', 'va_arg', 'va_end', 'va_copy'],
+    'stdbool.h': ['bool', 'true', 'false'],
+    'stddef.h': ['size_t', 'ptrdiff_t', 'wchar_t', 'max_align_t', 'NULL',
+        'offsetof'],
+    'stdint.h': integer_types('%s_MAX') + integer_types('%s_MIN') + [
+        'intmax_t', 'uintmax_t', 'intptr_t', 'uintptr_t', 'SIZE_MAX',
+        'PTRDIFF_MAX', 'INT8_C', 'INT16_C', 'INT32_C', 'INT64_C', 'UINT8_C',
+        'UINT16_C', 'UINT32_C', 'UINT64_C', 'INTMAX_C', 'UINTMAX_C'],
+    'stdio.h': ['FILE', 'fpos_t', 'size_t', 'NULL', 'EOF', 'BUFSIZ',
+        'stdin', 'stdout', 'stderr', 'fopen', 'fclose', 'fflush', 'fprintf',
+        'printf', 'sprintf', 'snprintf', 'vfprintf', 'vprintf', 'fputs',
+        'puts', 'fgets', 'fread', 'fwrite', 'perror', 'fseek', 'ftell',
+        'rewind', 'SEEK_SET', 'SEEK_CUR', 'SEEK_END'],
+    'stdlib.h': ['size_t', 'NULL', 'EXIT_SUCCESS', 'EXIT_FAILURE', 'abort',
+        'exit', 'atexit', 'malloc', 'calloc', 'realloc', 'free', 'getenv',
+        'atoi', 'atol', 'strtol', 'strtoul', 'strtod', 'qsort', 'bsearch',
+        'abs', 'labs', 'llabs', 'div_t', 'ldiv_t', 'lldiv_t'],
+    'string.h': ['size_t', 'NULL', 'memcpy', 'memmove', 'memset', 'memcmp',
+        'memchr', 'strcpy', 'strncpy', 'strcat', 'strncat', 'strcmp',
+        'strncmp', 'strchr', 'strrchr', 'strstr', 'strlen', 'strerror'],
+    'time.h': ['tm', 'timespec', 'time_t', 'clock_t', 'CLOCKS_PER_SEC',
+        'time', 'clock', 'difftime', 'mktime', 'localtime', 'gmtime',
+        'strftime', 'timespec_get', 'TIME_UTC'],
+    'wchar.h': ['wchar_t', 'wint_t', 'mbstate_t', 'WEOF', 'wcslen'],
+}
+
+
+class Use:
+    def __init__(self, kind, name, pointer, complete):
+        # kind is the tag keyword or '' for ordinary identifiers, complete is
+        # set when the full definition of a tag is required.
+        self.kind = kind
+        self.name = name
+        self.pointer = pointer
+        self.complete = complete
+
+    def key(self):
+        return (self.kind, self.name)
+
+    def ordered(self):
+        # Tags other than struct and union can not be forward declared and
+        # ordinary identifiers, e.g. typedef names, must always be declared.
+        return self.complete or not self.kind in ['struct', 'union']
+
+    def describe(self):
+        if '' == self.kind:
+            return self.name
+        return self.kind + ' ' + self.name
+
+
+class Declaration:
+    def __init__(self, node, parent):
+        self.node = node
+        self.parent = parent
+        self.name = ''
+        if node.text:
+            self.name = node.text.strip()
+        self.defines = []
+        self.declares = []
+        self.uses = []
+        self.aliases = []
+
+    def describe(self):
+        return self.node.tag + ' ' + self.name
+
+
+def type_uses(text, complete, uses):
+    pointer = '*' in text
+    kind = None
+    for token in identifier.findall(text):
+        if token in tags:
+            kind = token
+        elif token in keywords:
+            continue
+        elif None != kind:
+            uses.append(Use(kind, token, pointer, complete and not pointer))
+            kind = None
+        else:
+            uses.append(Use('', token, pointer, complete and not pointer))
+
+
+def text_identifiers(text):
+    return [token for token in identifier.findall(literals.sub(' ', text))
+            if not token in keywords]
+
+
+def text_uses(text, uses):
+    for token in text_identifiers(text):
+        uses.append(Use('', token, False, True))
+
+
+# Only the array bounds of a declarator, e.g. buf[CHAR_BIT], use identifiers,
+# the rest is the name being declared.
+def declarator_uses(text, uses):
+    if text:
+        for bound in bounds.findall(text):
+            text_uses(bound, uses)
+
+
+def tag_uses(declaration, node, complete):
+    name = ''
+    if node.text:
+        name = node.text.strip()
+    scope = node.find('scope')
+    if None == scope:
+        if '' != name:
+            declaration.uses.append(Use(node.tag, name, False, complete))
+        return
+    if '' != name:
+        declaration.defines.append((node.tag, name))
+    if 'enum' == node.tag:
+        for constant in scope.findall('constant'):
+            if constant.text:
+                declaration.defines.append(('', constant.text.strip()))
+            value = constant.find('value')
+            if None != value and value.text:
+                text_uses(value.text, declaration.uses)
+        return
+    for member in scope.findall('member'):
+        declarator_uses(member.text, declaration.uses)
+        type = member.find('type')
+        if None != type and type.text:
+            type_uses(type.text, True, declaration.uses)
+        function = member.find('function')
+        if None != function:
+            function_uses(declaration, function)
+        for nested in member:
+            if nested.tag in tags:
+                tag_uses(declaration, nested, True)
+
+
+def function_uses(declaration, node):
+    return_type = node.find('return')
+    if None != return_type and return_type.text:
+        type_uses(return_type.text, False, declaration.uses)
+    for param in node.findall('param'):
+        declarator_uses(param.text, declaration.uses)
+        type = param.find('type')
+        if None != type and type.text:
+            type_uses(type.text, False, declaration.uses)
+
+
+def declare(node, parent):
+    declaration = Declaration(node, parent)
+    if node.tag in tags:
+        if None == node.find('scope'):
+            if '' != declaration.name:
+                declaration.declares.append((node.tag, declaration.name))
+        else:
+            tag_uses(declaration, node, True)
+    elif 'typedef' == node.tag:
+        declaration.defines.append(('', declaration.name))
+        declarator_uses(declaration.name, declaration.uses)
+        type = node.find('type')
+        if None != type:
+            pointer = None != type.text and '*' in type.text
+            for nested in type:
+                if 'function' == nested.tag:
+                    function_uses(declaration, nested)
+                if nested.tag in tags:
+                    tag_uses(declaration, nested, False)
+                    if not pointer and nested.text:
+                        declaration.aliases.append(
+                                (nested.tag, nested.text.strip()))
+            if type.text:
+                uses = []
+                type_uses(type.text, False, uses)
+                declaration.uses.extend(uses)
+                if not pointer:
+                    declaration.aliases.extend([use.key() for use in uses])
+    elif 'function' == node.tag:
+        declaration.defines.append(('', declaration.name))
+        function_uses(declaration, node)
+    return declaration
+
+
+class Graph:
+    def __init__(self, interface):
+        self.interface = interface
+        # Each run of adjacent declarations within a container, only these
+        # are reordered so declarations never move across other tags.
+        self.runs = []
+        self.declarations = {}
+        self.definitions = {}
+        self.includes = []
+        self.names = set()
+        self.macros = set()
+        self.collect(interface)
+        self.available = self.provided()
+        for run in self.runs:
+            for declaration in run:
+                for key in declaration.defines:
+                    if not key in self.definitions:
+                        self.definitions[key] = declaration
+        for run in self.runs:
+            for declaration in run:
+                declaration.uses.extend(self.expand(declaration.uses, []))
+
+    def collect(self, parent):
+        run = []
+        for node in parent:
+            if node.tag in declarations:
+                declaration = declare(node, parent)
+                self.declarations[node] = declaration
+                run.append(declaration)
+                continue
+            if 0 < len(run):
+                self.runs.append(run)
+                run = []
+            if node.tag in containers:
+                self.collect(node)
+            elif 'include' == node.tag:
+                self.includes.append((node, parent))
+            elif 'define' == node.tag:
+                if node.text:
+                    self.macros.add(node.text.strip())
+                params = [param.text.strip() for param in
+                        node.findall('param') if param.text]
+                value = node.find('value')
+                if None != value and value.text:
+                    self.names.update([name for name in
+                        text_identifiers(value.text) if not name in params])
+            elif 'code' == node.tag and node.text:
+                self.names.update(text_identifiers(node.text))
+        if 0 < len(run):
+            self.runs.append(run)
+
+    def expand(self, uses, seen):
+        # Using a typedef by value requires the definition of the type it
+        # aliases, add those uses so they are ordered correctly as well.
+        expanded = []
+        for use in uses:
+            if '' != use.kind or not use.complete or use.name in seen:
+                continue
+            typedef = self.definitions.get(use.key())
+            if None == typedef or 'typedef' != typedef.node.tag:
+                continue
+            aliases = [Use(kind, name, False, True)
+                    for kind, name in typedef.aliases]
+            expanded.extend(aliases)
+            expanded.extend(self.expand(aliases, seen + [use.name]))
+        return expanded
+
+    def sort(self, run, report):
+        position = {}
+        for index, declaration in enumerate(run):
+            position[declaration] = index
+        users = dict([(declaration, []) for declaration in run])
+        depends = dict([(declaration, 0) for declaration in run])
+        for declaration in run:
+            for use in declaration.uses:
+                if not use.ordered():
+                    continue
+                definition = self.definitions.get(use.key())
+                if definition in position and definition != declaration and \
+                        not declaration in users[definition]:
+                    users[definition].append(declaration)
+                    depends[declaration] += 1
+        ready = [index for index, declaration in enumerate(run)
+                if 0 == depends[declaration]]
+        heapq.heapify(ready)
+        order = []
+        while 0 < len(ready):
+            declaration = run[heapq.heappop(ready)]
+            order.append(declaration)
+            for user in users[declaration]:
+                depends[user] -= 1
+                if 0 == depends[user]:
+                    heapq.heappush(ready, position[user])
+        if len(order) != len(run):
+            cycle = [declaration for declaration in run
+                    if not declaration in order]
+            report.append('circular dependency: ' +
+                    ', '.join([declaration.describe() for declaration in cycle]))
+            order.extend(cycle)
+        return order
+
+    def reorder(self, report):
+        for run in self.runs:
+            order = self.sort(run, report)
+            if order == run:
+                continue
+            parent = run[0].parent
+            slots = [list(parent).index(declaration.node)
+                    for declaration in run]
+            for slot, declaration in zip(sorted(slots), order):
+                parent[slot] = declaration.node
+
+    def forward(self, parent, declared, defined, report):
+        for node in list(parent):
+            if node.tag in containers:
+                self.forward(node, declared, defined, report)
+                continue
+            declaration = self.declarations.get(node)
+            if None == declaration:
+                continue
+            for key in declaration.defines:
+                if '' != key[0]:
+                    declared.add(key)
+            for use in declaration.uses:
+                key = use.key()
+                if not use.ordered():
+                    if key in declared:
+                        continue
+                    forward = XML.Element(use.kind)
+                    forward.text = use.name
+                    forward.tail = node.tail
+                    parent.insert(list(parent).index(node), forward)
+                    declared.add(key)
+                    report.append('forward declaration: ' + use.describe() +
+                            ' for ' + declaration.describe())
+                elif key in defined or key in declaration.defines:
+                    continue
+                elif key in self.definitions:
+                    report.append(use.describe() + ' is used by ' +
+                            declaration.describe() + ' before it is defined')
+                elif '' != use.kind and not use.name in self.available:
+                    report.append(use.describe() + ' is incomplete in ' +
+                            declaration.describe())
+            declared.update(declaration.declares)
+            declared.update(declaration.defines)
+            defined.update(declaration.defines)
+
+    def external(self):
+        # Tags are looked up by name alone, an include providing a tag must
+        # be kept even when only a pointer to it is used.
+        names = set(self.names)
+        for declaration in self.declarations.values():
+            for use in declaration.uses:
+                if not use.key() in self.definitions:
+                    names.add(use.name)
+        return names.difference(self.macros)
+
+    def unresolved(self):
+        # Identifiers and tags needing a full definition which neither the
+        # schema nor any include is known to provide, a tag only used through
+        # a pointer needs no definition at all.
+        names = set([name for name in self.names
+            if not ('', name) in self.definitions])
+        for declaration in self.declarations.values():
+            for use in declaration.uses:
+                if use.key() in self.definitions:
+                    continue
+                if '' == use.kind:
+                    names.add(use.name)
+                elif use.ordered():
+                    names.add(use.describe())
+        return sorted([name for name in names.difference(self.macros)
+            if not name.split()[-1] in self.available])
+
+    def provides(self, node):
+        provides = node.attrib.get('provides')
+        if None != provides:
+            return provides.split()
+        if node.text and node.text.strip() in standard:
+            return standard[node.text.strip()]
+        return None
+
+    def provided(self):
+        names = set()
+        for node, parent in self.includes:
+            names.update(self.provides(node) or [])
+        return names
+
+    def prune(self, remove, report):
+        # An include is needed when it provides an identifier used by the
+        # schema which no earlier include has already provided. While
+        # something the schema uses is provided by none of them any include
+        # could be the one which defines it, so all are kept.
+        names = self.external()
+        unresolved = self.unresolved()
+        for node, parent in self.includes:
+            name = ''
+            if node.text:
+                name = node.text.strip()
+            provides = self.provides(node)
+            if None == provides:
+                report.append('unknown include: ' + name)
+                continue
+            needed = names.intersection(provides)
+            if 0 < len(needed):
+                names.difference_update(needed)
+                continue
+            if 0 < len(unresolved):
+                shown = ', '.join(unresolved[:3])
+                if 3 < len(unresolved):
+                    shown += ' and ' + str(len(unresolved) - 3) + ' more'
+                report.append('unused include: ' + name + ', kept as ' +
+                        shown + ' may be defined by it')
+                continue
+            report.append('unused include: ' + name)
+            if remove:
+                parent.remove(node)
+
+
+# Return a copy of the interface with declarations ordered so that each is
+# defined before it is required, struct and union forward declarations added
+# where only an incomplete type is needed and optionally unused includes
+# removed, along with a list of messages describing the changes and problems.
+def resolve(interface, order = True, prune_includes = False):
+    interface = copy.deepcopy(interface)
+    graph = Graph(interface)
+    report = []
+    if order:
+        graph.reorder(report)
+        graph.forward(interface, set(), set(), report)
+    graph.prune(prune_includes, report)
+    return interface, report
+
+
+def help():
+    print('depends.py [options] <schema>\n')
+    print('options:')
+    print('        -h                            show this help message')
+    print('        -i                            remove unused includes')
+    print('        -o <schema>                   write the resolved schema')
+
+
+def main():
+    if 1 == len(sys.argv):
+        help()
+        sys.exit(1)
+
+    options, arguments = getopt.getopt(sys.argv[1:], 'hio:')
+
+    prune_includes = False
+    output = None
+    for opt, arg in options:
+        if opt in ('-h'):
+            help()
+            sys.exit(0)
+        elif opt in ('-i'):
+            prune_includes = True
+        elif opt in ('-o'):
+            output = arg
+
+    if 1 != len(arguments):
+        raise Exception('expected one schema file')
+    schema = arguments[0]
+    if not path.exists(schema) or not path.isfile(schema):
+        raise Exception('invalid schema file:', schema);
+
+    interface, report = resolve(Schema.load(schema), True, prune_includes)
+    for message in report:
+        print(message)
+    if None != output:
+        Schema.dump(interface, output)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,24 +22,13 @@
 
 from __future__ import print_function
 from os import path
-import xml.etree.ElementTree as XML
+import depends as Depends
+import schema as Schema
+import copy
 import getopt
-import json
 import sys
 
 
-indent = '  '
-prefix = ''
-functions_only = False
-includes = []
-stub = None
-stub_includes = []
-stub_guards_on = False
-stub_prefix = ''
-stub_qualifier = ''
-variables = []
-
-
 class Variable:
     name = ''
     values = []
@@ -123,25 +112,26 @@ class Doxygen:
             return True
         return False
 
-    def output(self):
+    def output(self, prefix = ''):
         sections = []
         if None != self.brief:
-            sections.append('/// ' + '@brief ' + replace_prefix(self.brief) + '\n')
+            sections.append('/// ' + '@brief ' +
+                    replace_prefix(self.brief, prefix) + '\n')
         if None != self.detail:
             detail = ''
             for line in self.detail.split('\n'):
                 detail += '/// ' + line + '\n'
-            sections.append(replace_prefix(detail))
+            sections.append(replace_prefix(detail, prefix))
         if 0 != len(self.params):
             param_section = ''
             for param in self.params:
                 param_section += '/// ' + param + '\n'
             if '' != param_section:
-                sections.append(replace_prefix(param_section))
+                sections.append(replace_prefix(param_section, prefix))
         if None != self.ret:
-            sections.append('/// @return ' + replace_prefix(self.ret) + '\n')
+            sections.append('/// @return ' + replace_prefix(self.ret, prefix) + '\n')
         if None != self.see:
-            sections.append('/// @see ' + replace_prefix(self.see) + '\n')
+            sections.append('/// @see ' + replace_prefix(self.see, prefix) + '\n')
         text = ''
         if 0 != len(sections):
             text = '///\n'.join(sections)
@@ -164,7 +154,7 @@ def is_identifier(identifier):
     return True
 
 
-def replace_prefix(identifier):
+def replace_prefix(identifier, prefix = ''):
     output = identifier.replace("${prefix}", prefix)
     output = output.replace("${Prefix}", prefix.capitalize())
     output = output.replace("${PREFIX}", prefix.upper())
@@ -178,7 +168,7 @@ def replace_stub_prefix(identifier, name = ''):
     return output
 
 
-def replace_variables(text):
+def replace_variables(text, variables):
     start = text.find('${')
     while -1 != start:
         end = text.find('}')
@@ -194,60 +184,123 @@ def replace_variables(text):
     return text
 
 
-def replace_stub(text, name, arguments):
-    stub = ''
-    text = text.replace("${name}", name.replace("${prefix}", ""))
-    capturing = False
-
-    loop_variable = None
-    loop_iterator = ''
-    loop_lines = []
-
-    for line in text.split('\n'):
-        if '${foreach}' in line:
-            capturing = True
-
-            # Reset loop state
-            loop_variable = None
-            loop_iterator = ''
-            loop_lines = []
-
-            expr = line[line.find('(') + 1:line.find(')')]
-            in_pos = expr.find('in')
-            iter_name = expr[:in_pos].strip()
-            var_name = expr[in_pos + 2:].strip()
-            for variable in variables:
-                if var_name == variable.name:
-                    for value in variable.values:
-                        loop_variable = variable
-                        loop_iterator = iter_name
-
-            if None == loop_variable:
-                raise Exception('invalid ${foreach} variable', var_name)
-        elif '${endforeach}' in line:
-            # TODO: Write loop
-            for value in loop_variable.values:
-                for line in loop_lines:
-                    stub += line.replace('${' + loop_iterator + '}', value) + '\n'
-            capturing = False
-        elif capturing:
-            loop_lines.append(line)
-        else:
-            stub += line + '\n'
-
-    stub = stub.replace("${forward}", ', '.join(arguments))
-    # TODO: Support any numbered argument!
-    stub = stub.replace("${0}", arguments[0])
-    stub = replace_stub_prefix(stub, stub_prefix)
-    stub = replace_prefix(stub)
-    return replace_variables(stub)
-
-
-def include(node, newline):
-    if not functions_only:
+# Holds the options used to render a schema, render() and stream() work on a
+# private copy so a single Generator can be shared between threads.
+class Generator:
+
+    def __init__(self, prefix = '', indent = '  ', functions_only = False,
+            stub = None, stub_guards_on = False, variables = None,
+            order_declarations = False, prune_includes = False):
+        if '' != prefix and not is_identifier(prefix):
+            raise Exception('invalid C prefix:', prefix)
+        self.indent = indent
+        self.prefix = prefix
+        self.functions_only = functions_only
+        self.stub_name = stub
+        self.stub_guards_on = stub_guards_on
+        self.variables = tuple(variables or [])
+        self.order_declarations = order_declarations
+        self.prune_includes = prune_includes
+        # Populated from the schema's <stubs> tag by find_stub() on the copy
+        # made for each render, never on the shared instance.
+        self.stub = None
+        self.stub_includes = []
+        self.stub_prefix = ''
+        self.stub_qualifier = ''
+
+    def render(self, interface):
+        return ''.join(self.stream(interface))
+
+    def stream(self, interface):
+        if self.order_declarations or self.prune_includes:
+            interface = Depends.resolve(interface, self.order_declarations,
+                    self.prune_includes)[0]
+        return self.bind(interface).generate(interface)
+
+    def bind(self, interface):
+        context = copy.copy(self)
+        context.stub_includes = []
+        if None != self.stub_name:
+            context.find_stub(interface)
+        return context
+
+    def find_stub(self, interface):
+        stubs = interface.find('stubs')
+        if None == stubs:
+            raise Exception('missing stubs tag')
+        for node in stubs:
+            if 'stub' == node.tag:
+                if self.stub_name == node.attrib.get('name'):
+                    self.stub = node
+                    prefix_stub = node.attrib.get('prefix')
+                    if prefix_stub:
+                        self.stub_prefix = prefix_stub
+                    qual = node.attrib.get('qualifier')
+                    if qual:
+                        self.stub_qualifier = qual
+            elif 'include' == node.tag:
+                self.stub_includes.append(node.text)
+        if None == self.stub:
+            raise Exception('could not find stub named:', self.stub_name)
+
+    def replace_prefix(self, identifier):
+        return replace_prefix(identifier, self.prefix)
+
+    def replace_stub(self, text, name, arguments):
+        stub = ''
+        text = text.replace("${name}", name.replace("${prefix}", ""))
+        capturing = False
+
+        loop_variable = None
+        loop_iterator = ''
+        loop_lines = []
+
+        for line in text.split('\n'):
+            if '${foreach}' in line:
+                capturing = True
+
+                # Reset loop state
+                loop_variable = None
+                loop_iterator = ''
+                loop_lines = []
+
+                expr = line[line.find('(') + 1:line.find(')')]
+                in_pos = expr.find('in')
+                iter_name = expr[:in_pos].strip()
+                var_name = expr[in_pos + 2:].strip()
+                for variable in self.variables:
+                    if var_name == variable.name:
+                        for value in variable.values:
+                            loop_variable = variable
+                            loop_iterator = iter_name
+
+                if None == loop_variable:
+                    raise Exception('invalid ${foreach} variable', var_name)
+            elif '${endforeach}' in line:
+                # TODO: Write loop
+                for value in loop_variable.values:
+                    for line in loop_lines:
+                        stub += line.replace('${' + loop_iterator + '}', value) + '\n'
+                capturing = False
+            elif capturing:
+                loop_lines.append(line)
+            else:
+                stub += line + '\n'
+
+        stub = stub.replace("${forward}", ', '.join(arguments))
+        # TODO: Support any numbered argument!
+        if 0 < len(arguments):
+            stub = stub.replace("${0}", arguments[0])
+        stub = replace_stub_prefix(stub, self.stub_prefix)
+        stub = self.replace_prefix(stub)
+        return replace_variables(stub, self.variables)
+
+    def include(self, node, newline):
+        if self.functions_only:
+            return ''
         if None == node.text:
             raise Exception('missing include file')
-        name = replace_prefix(node.text.strip())
+        name = self.replace_prefix(node.text.strip())
         include = '#' + node.tag + ' '
         form = node.attrib.get('form')
         if None == form or 'angle' == form:
@@ -258,41 +311,45 @@ def include(node, newline):
             raise Exception('invalid include form: ' + form)
         if newline:
             include += '\n'
-        print(include)
-
+        return include + '\n'
 
-def define(node, newline):
-    if not functions_only:
+    def define(self, node, newline):
+        if self.functions_only:
+            return ''
         docs = Doxygen(node.find('doxygen'))
-        define = '#' + node.tag + ' ' + replace_prefix(node.text.strip()).upper()
+        define = '#' + node.tag + ' ' + \
+                self.replace_prefix(node.text.strip()).upper()
         params = node.findall('param')
         # TODO Output nice diagnostics for unexpected input, use is_identifier()
         if 0 < len(params):
             param_names = []
             for param in params:
-                param_names.append(replace_prefix(param.text.strip()))
+                param_names.append(self.replace_prefix(param.text.strip()))
             define += '(' + ', '.join(param_names) + ')'
         value = node.find('value')
         if None != value:
             lines = value.text.split('\n')
             if 1 < len(lines):
                 continuation = ' \\\n'
-                define += continuation + indent + (continuation + indent).join(lines)
+                define += continuation + self.indent + \
+                        (continuation + self.indent).join(lines)
             elif 1 == len(lines):
                 define += ' ' + lines[0]
         if newline:
             define += '\n'
+        text = ''
         if not docs.empty():
-            print(docs.output())
-        print(define)
-
+            text += docs.output(self.prefix) + '\n'
+        return text + define + '\n'
 
-def struct(node, semicolon, newline):
-    if not functions_only:
+    def struct(self, node, semicolon, newline):
+        if self.functions_only:
+            return ''
+        indent = self.indent
         doxygen = Doxygen(node.find('doxygen'))
         struct = 'struct'
         if node.text:
-            name = replace_prefix(node.text.strip())
+            name = self.replace_prefix(node.text.strip())
             if not is_identifier(name):
                 raise Exception('invalid struct name: ' + name)
             struct += ' ' + name
@@ -305,7 +362,8 @@ def struct(node, semicolon, newline):
                 member_decls = []
                 for member in members:
                     if None != member:
-                        doxygen_member = Doxygen(member.find('doxygen')).output()
+                        doxygen_member = Doxygen(member.find('doxygen')).output(
+                                self.prefix)
                         type = member.find('type')
                         if None != type:
                             member_decl = ''
@@ -316,10 +374,11 @@ def struct(node, semicolon, newline):
                                     doxygen_member += indent + line + '\n'
                                 doxygen_member = doxygen_member.rstrip()
                                 member_decl += doxygen_member + '\n'
-                            member_decl += indent + replace_prefix(type.text.strip())
+                            member_decl += indent + \
+                                    self.replace_prefix(type.text.strip())
                             if member.text:
                                 member_decl += ' ' + \
-                                        replace_prefix(member.text.strip())
+                                        self.replace_prefix(member.text.strip())
                             member_decls.append(member_decl)
                         member_function = member.find('function')
                         if None != member_function:
@@ -329,15 +388,18 @@ def struct(node, semicolon, newline):
                             member_decl = ''
                             if '' != doxygen_member:
                                 member_decl += indent + doxygen_member + '\n'
-                            member_decl += indent + function(member_function, False, False, False)
+                            member_decl += indent + self.function(
+                                    member_function, False, False, False)
                             member_decls.append(member_decl)
                         member_union = member.find('union')
                         if None != member_union:
                             union_decls = []
                             if '' != doxygen_member:
                                 union_decls.append(doxygen_member)
-                            union_decls.extend(union(member_union, False, False, False).split('\n'))
-                            union_decl = '\n'.join([indent + decl for decl in union_decls])
+                            union_decls.extend(self.union(
+                                member_union, False, False).split('\n'))
+                            union_decl = '\n'.join(
+                                    [indent + decl for decl in union_decls])
                             member_decls.append(union_decl)
                 if 0 < len(member_decls):
                     struct += '\n' + ';\n'.join(member_decls) + ';\n'
@@ -346,17 +408,17 @@ def struct(node, semicolon, newline):
             struct += ';'
         if newline:
             struct += '\n\n'
-        docs = doxygen.output()
+        docs = doxygen.output(self.prefix)
         if '' != docs:
-            print(docs)
-        sys.stdout.write(struct)
-
+            struct = docs + '\n' + struct
+        return struct
 
-def union(node, semicolon, newline, out = True):
-    if not functions_only:
+    def union(self, node, semicolon, newline):
+        if self.functions_only:
+            return ''
         union = 'union'
         if node.text:
-            name = replace_prefix(node.text.strip())
+            name = self.replace_prefix(node.text.strip())
             if not is_identifier(name):
                 raise Exception('invalid union name: ' + name)
             union += ' ' + name
@@ -368,20 +430,21 @@ def union(node, semicolon, newline, out = True):
                 member_decls = []
                 for member in members:
                     if None != member:
-                        member_name = replace_prefix(member.text.strip())
+                        member_name = self.replace_prefix(member.text.strip())
                         type = member.find('type')
                         if None != type:
-                            member_decl = indent + replace_prefix(type.text.strip())
+                            member_decl = self.indent + \
+                                    self.replace_prefix(type.text.strip())
                             if None == member.text:
                                 raise Exception('union member has no name')
                             member_decl += ' ' + member_name
                             member_decls.append(member_decl)
                         struct = member.find('struct')
                         if None != struct:
-                            struct_name = replace_prefix(struct.text.strip())
+                            struct_name = self.replace_prefix(struct.text.strip())
                             if None != struct_name:
-                                member_decl = indent + 'struct ' + struct_name + \
-                                        ' ' + member_name
+                                member_decl = self.indent + 'struct ' + \
+                                        struct_name + ' ' + member_name
                                 member_decls.append(member_decl)
                 if 0 < len(member_decls):
                     union += '\n' + ';\n'.join(member_decls) + ';\n'
@@ -390,22 +453,19 @@ def union(node, semicolon, newline, out = True):
             union += ';'
         if newline:
             union += '\n\n'
-        if out:
-            sys.stdout.write(union)
-        else:
-            return union
-
+        return union
 
-def enum(node, semicolon, newline):
-    if not functions_only:
+    def enum(self, node, semicolon, newline):
+        if self.functions_only:
+            return ''
         enum = 'enum'
-        doxygen = Doxygen(node.find('doxygen')).output()
+        doxygen = Doxygen(node.find('doxygen')).output(self.prefix)
         if '' != doxygen:
             enum = doxygen + '\n' + enum
         if node.text:
             name = node.text.strip()
             if '' != name:
-                enum += ' ' + replace_prefix(name)
+                enum += ' ' + self.replace_prefix(name)
         enum += ' {'
         scope = node.find('scope')
         # TODO Output nice diagnostics for unexpected input, use is_identifier()
@@ -418,16 +478,18 @@ def enum(node, semicolon, newline):
             for constant in constants:
                 if None != constant:
                     decl = ''
-                    doxygen = Doxygen(constant.find('doxygen')).output()
+                    doxygen = Doxygen(constant.find('doxygen')).output(
+                            self.prefix)
                     if '' != doxygen:
                         for line in doxygen.split('\n'):
-                            decl = indent + line + '\n'
+                            decl = self.indent + line + '\n'
                     if None == constant.text:
                         raise Exception("invalid enum constant")
-                    decl += indent + replace_prefix(constant.text.strip())
+                    decl += self.indent + \
+                            self.replace_prefix(constant.text.strip())
                     value = constant.find('value')
                     if None != value:
-                        decl += ' = ' + replace_prefix(value.text.strip())
+                        decl += ' = ' + self.replace_prefix(value.text.strip())
                     constant_decls.append(decl)
             enum += ',\n'.join(constant_decls) + '\n'
         enum += '}'
@@ -435,233 +497,228 @@ def enum(node, semicolon, newline):
             enum += ';'
         if newline:
             enum += '\n\n'
-        sys.stdout.write(enum)
-
+        return enum
 
-def typedef(node, newline):
-    if not functions_only:
+    def typedef(self, node, newline):
+        if self.functions_only:
+            return ''
         docs = Doxygen(node.find('doxygen'))
-        name = replace_prefix(node.text.strip())
+        name = self.replace_prefix(node.text.strip())
         if None == name:
             raise Exception('missing typedef type name')
         type = node.find('type')
         if None == type:
             raise Exception('missing typedef type')
+        typedef = ''
         if '' != docs:
-            print(docs.output())
-        sys.stdout.write('typedef ')
-        if None != type.getchildren():
-            generate(type, False, False)
-            if None != type.text:
-                sys.stdout.write(replace_prefix(type.text.strip()))
-            sys.stdout.write(' ' + name);
-        print(';\n')
-
-
-def function(node, semicolon, newline, out = True):
-    doxygen = Doxygen(node.find('doxygen'))
-    if None == node.text:
-        raise Exception('missing function name')
-    return_type = node.find('return')
-    if None == return_type:
-        raise Exception('missing function return')
-    if None == return_type.text:
-        raise Exception("missing function return type name")
-    doxygen_return = return_type.find('doxygen')
-    if None != doxygen_return:
-        tag = doxygen_return.find('return')
-        if None != tag:
-            doxygen.ret = tag.text
-    function = replace_prefix(return_type.text.strip()) + ' '
-    prefix_name = node.text.strip()
-    name = replace_prefix(replace_stub_prefix(prefix_name, stub_prefix))
-    prefix_name = replace_stub_prefix(prefix_name)
-    if None != stub:
-        name = name
-    form = node.attrib.get('form')
-    if None != form:
-        if 'pointer' == form:
-            function += '(*' + name + ')('
+            typedef += docs.output(self.prefix) + '\n'
+        typedef += 'typedef '
+        typedef += ''.join(self.generate(type, False, False))
+        if None != type.text:
+            typedef += self.replace_prefix(type.text.strip())
+        typedef += ' ' + name
+        return typedef + ';\n\n'
+
+    def function(self, node, semicolon, newline, body = True):
+        doxygen = Doxygen(node.find('doxygen'))
+        if None == node.text:
+            raise Exception('missing function name')
+        return_type = node.find('return')
+        if None == return_type:
+            raise Exception('missing function return')
+        if None == return_type.text:
+            raise Exception("missing function return type name")
+        doxygen_return = return_type.find('doxygen')
+        if None != doxygen_return:
+            tag = doxygen_return.find('return')
+            if None != tag:
+                doxygen.ret = tag.text
+        function = self.replace_prefix(return_type.text.strip()) + ' '
+        prefix_name = node.text.strip()
+        name = self.replace_prefix(
+                replace_stub_prefix(prefix_name, self.stub_prefix))
+        prefix_name = replace_stub_prefix(prefix_name)
+        form = node.attrib.get('form')
+        if None != form:
+            if 'pointer' == form:
+                function += '(*' + name + ')('
+            else:
+                raise Exception('invalid function form: ' + form)
         else:
-            raise Exception('invalid function form: ' + form)
-    else:
-        function += name + '('
-    params = node.findall('param')
-    doxygen.params = []
-    param_names = []
-    if 0 < len(params):
-        param_decls = []
-        for param in params:
-            param_type = param.find('type')
-            if None == param_type:
-                raise Exception('missing function parameter type')
-            if None == param_type.text:
-                raise Exception('missing function parameter type name')
-            decl = replace_prefix(param_type.text.strip())
-            if None != param.text:
-                decl += ' ' + replace_prefix(param.text.strip())
-                doxygen_param = DoxygenParam(param.text, param.find('doxygen')).output()
-                if '' != doxygen_param:
-                    doxygen.params.append(doxygen_param)
-                param_names.append(param.text)
-            param_decls.append(decl)
-        function += ', '.join(param_decls)
-    function += ')'
-    if semicolon:
-        function += ';'
-    if newline:
+            function += name + '('
+        params = node.findall('param')
+        doxygen.params = []
+        param_names = []
+        if 0 < len(params):
+            param_decls = []
+            for param in params:
+                param_type = param.find('type')
+                if None == param_type:
+                    raise Exception('missing function parameter type')
+                if None == param_type.text:
+                    raise Exception('missing function parameter type name')
+                decl = self.replace_prefix(param_type.text.strip())
+                if None != param.text:
+                    decl += ' ' + self.replace_prefix(param.text.strip())
+                    doxygen_param = DoxygenParam(
+                            param.text, param.find('doxygen')).output()
+                    if '' != doxygen_param:
+                        doxygen.params.append(doxygen_param)
+                    param_names.append(param.text)
+                param_decls.append(decl)
+            function += ', '.join(param_decls)
+        function += ')'
+        if semicolon:
+            function += ';'
+        if newline:
+            function += '\n'
+        if not doxygen.empty() and None == self.stub:
+            function = doxygen.output(self.prefix) + '\n' + function
+        if not body:
+            return function
         function += '\n'
-    if not doxygen.empty() and None == stub:
-        function = doxygen.output() + '\n' + function
-    if out:
-        print(function)
-        if None != stub:
-            print('{\n' + replace_stub(stub.text, prefix_name, param_names) + '\n}\n')
-    else:
+        if None != self.stub:
+            function += '{\n' + self.replace_stub(
+                    self.stub.text, prefix_name, param_names) + '\n}\n\n'
         return function
 
+    def comment(self, node, newline):
+        comment = '// '
+        if node.text:
+            lines = node.text.split('\n')
+            comment += '\n// '.join(lines)
+        if newline:
+            comment += '\n'
+        return comment + '\n'
 
-def comment(node, newline):
-    comment = '// '
-    if node.text:
-        lines = node.text.split('\n')
-        comment += '\n// '.join(lines)
-    if newline:
-        comment += '\n'
-    print(comment)
-
-
-def block(node):
-    generate(node, False, False)
-    print()
-
+    def block(self, node):
+        return ''.join(self.generate(node, False, False)) + '\n'
 
-def scope(node, semicolon, newline):
-    scope = ''
-    open = True
-    close = True
-    form = node.attrib.get('form')
-    if form:
-        if 'open' == form:
-            close = False
-        elif 'close' == form:
-            open = False
-        else:
-            raise Exception('invalid scope form: ' + form)
-    name = ''
-    if node.text:
-        name = replace_prefix(node.text.strip())
-    if open:
-        if '' == name:
-            print('{')
-        else:
-            print(name + ' {')
-    generate(node, semicolon, newline)
-    if close:
-        if '' == name:
-            print('}')
+    def scope(self, node, semicolon, newline):
+        scope = ''
+        open = True
+        close = True
+        form = node.attrib.get('form')
+        if form:
+            if 'open' == form:
+                close = False
+            elif 'close' == form:
+                open = False
+            else:
+                raise Exception('invalid scope form: ' + form)
+        name = ''
+        if node.text:
+            name = self.replace_prefix(node.text.strip())
+        if open:
+            if '' == name:
+                scope += '{\n'
+            else:
+                scope += name + ' {\n'
+        scope += ''.join(self.generate(node, semicolon, newline))
+        if close:
+            if '' == name:
+                scope += '}\n'
+            else:
+                scope += '}  // ' + name + '\n'
+        if newline:
+            scope += '\n'
+        return scope
+
+    def guard(self, node, semicolon, newline):
+        if not node.text:
+            raise Exception('missing guard name')
+        name = self.replace_prefix(
+                replace_stub_prefix(node.text.strip(), self.stub_prefix))
+        form = node.attrib.get('form')
+        if 'include' == form:
+            guard = '#ifndef ' + name + '\n'
+            guard += '#define ' + name + '\n\n'
+            guard += ''.join(self.generate(node, semicolon, True))
+        elif 'defined':
+            guard = '#ifdef ' + name + '\n'
+            guard += ''.join(self.generate(node, semicolon, False))
         else:
-            print('}  // ' + name)
-    if newline:
-        print()
-
-
-def guard(node, semicolon, newline):
-    if not node.text:
-        raise Exception('missing guard name')
-    name = replace_prefix(replace_stub_prefix(node.text.strip(), stub_prefix))
-    form = node.attrib.get('form')
-    if 'include' == form:
-        print('#ifndef ' + name)
-        print('#define ' + name + '\n')
-        generate(node, semicolon, True)
-        print('#endif  // ' + name)
-    elif 'defined':
-        print('#ifdef ' + name)
-        generate(node, semicolon, False)
-        print('#endif  // ' + name)
-    else:
-        print('#ifndef ' + name)
-        generate(node, semicolon, False)
-        print('#endif  // ' + name)
-    if newline:
-        print()
-
-
-def code(node):
-    if node.text:
-        print(replace_prefix(node.text))
-
-def includes_stubs():
-    print(replace_prefix('#include <${prefix}/${prefix}.h>'))
-    for stub_include in stub_includes:
-        if '${foreach}' in stub_include:
-            loop = stub_include[stub_include.find('(') + 1 : stub_include.find(')')].split(' ')
-            elem = loop[0]
-            var_name = loop[2]
-            expr = stub_include[stub_include.find(')') + 1 : stub_include.find('${endforeach}')]
-            for variable in variables:
-                if var_name == variable.name:
-                    for value in variable.values:
-                        print('#include <' + expr.replace('${' + elem + '}', value) + '>')
+            guard = '#ifndef ' + name + '\n'
+            guard += ''.join(self.generate(node, semicolon, False))
+        guard += '#endif  // ' + name + '\n'
+        if newline:
+            guard += '\n'
+        return guard
+
+    def code(self, node):
+        if node.text:
+            return self.replace_prefix(node.text) + '\n'
+        return ''
+
+    def includes_stubs(self):
+        includes = self.replace_prefix('#include <${prefix}/${prefix}.h>') + '\n'
+        for stub_include in self.stub_includes:
+            if '${foreach}' in stub_include:
+                loop = stub_include[stub_include.find('(') + 1 : stub_include.find(')')].split(' ')
+                elem = loop[0]
+                var_name = loop[2]
+                expr = stub_include[stub_include.find(')') + 1 : stub_include.find('${endforeach}')]
+                for variable in self.variables:
+                    if var_name == variable.name:
+                        for value in variable.values:
+                            includes += '#include <' + \
+                                    expr.replace('${' + elem + '}', value) + '>\n'
+            else:
+                includes += self.replace_prefix(
+                        '#include <' + stub_include + '>') + '\n'
+        return includes + '\n'
+
+    def generate(self, parent, semicolon = True, newline = True):
+        if None == self.stub:
+            for node in parent:
+                if 'include' == node.tag:
+                    yield self.include(node, newline)
+                elif 'define' == node.tag:
+                    yield self.define(node, newline)
+                elif 'struct' == node.tag:
+                    yield self.struct(node, semicolon, newline)
+                elif 'union' == node.tag:
+                    yield self.union(node, semicolon, newline)
+                elif 'enum' == node.tag:
+                    yield self.enum(node, semicolon, newline)
+                elif 'typedef' == node.tag:
+                    yield self.typedef(node, newline)
+                elif 'function' == node.tag:
+                    yield self.function(node, semicolon, newline)
+                elif 'comment' == node.tag:
+                    yield self.comment(node, newline)
+                elif 'block' == node.tag:
+                    yield self.block(node)
+                elif 'scope' == node.tag:
+                    yield self.scope(node, semicolon, newline)
+                elif 'guard' == node.tag:
+                    yield self.guard(node, semicolon, newline)
+                elif 'code' == node.tag:
+                    yield self.code(node)
         else:
-            print(replace_prefix('#include <' + stub_include + '>'))
-    print()
-
-
-def generate(parent, semicolon = True, newline = True):
-    global prefix
-
-    if None == stub:
-        for node in parent:
-            if 'include' == node.tag:
-                include(node, newline)
-            elif 'define' == node.tag:
-                define(node, newline)
-            elif 'struct' == node.tag:
-                struct(node, semicolon, newline)
-            elif 'union' == node.tag:
-                union(node, semicolon, newline)
-            elif 'enum' == node.tag:
-                enum(node, semicolon, newline)
-            elif 'typedef' == node.tag:
-                typedef(node, newline)
-            elif 'function' == node.tag:
-                function(node, semicolon, newline)
-            elif 'comment' == node.tag:
-                comment(node, newline)
-            elif 'block' == node.tag:
-                block(node)
-            elif 'scope' == node.tag:
-                scope(node, semicolon, newline)
-            elif 'guard' == node.tag:
-                guard(node, semicolon, newline)
-            elif 'code' == node.tag:
-                code(node)
-    else:
-        for node in parent:
-            if 'comment' == node.tag:
-                comment(node, True)
-            elif 'guard' == node.tag:
-                if stub_guards_on:
-                    guard(node, True, True)
-                else:
-                    for guard_node in node:
-                        if 'function' == guard_node.tag:
-                            function(guard_node, False, False)
-            elif 'scope' == node.tag:
-                scope(node, True, False)
-            elif 'function' == node.tag:
-                if '' != stub_qualifier:
-                    sys.stdout.write(stub_qualifier + ' ')
-                function(node, False, False)
-            elif 'block' == node.tag:
-                # TODO: This is a hack to place include's correctly, it is not
-                # a general solution as the includes will be inserted more
-                # than once if there is more than <block></block> in the schema.
-                # This should be replaced with a general solution if it causes
-                # any problems.
-                includes_stubs()
+            for node in parent:
+                if 'comment' == node.tag:
+                    yield self.comment(node, True)
+                elif 'guard' == node.tag:
+                    if self.stub_guards_on:
+                        yield self.guard(node, True, True)
+                    else:
+                        for guard_node in node:
+                            if 'function' == guard_node.tag:
+                                yield self.function(guard_node, False, False)
+                elif 'scope' == node.tag:
+                    yield self.scope(node, True, False)
+                elif 'function' == node.tag:
+                    if '' != self.stub_qualifier:
+                        yield self.stub_qualifier + ' '
+                    yield self.function(node, False, False)
+                elif 'block' == node.tag:
+                    # TODO: This is a hack to place include's correctly, it is not
+                    # a general solution as the includes will be inserted more
+                    # than once if there is more than <block></block> in the schema.
+                    # This should be replaced with a general solution if it causes
+                    # any problems.
+                    yield self.includes_stubs()
 
 
 def help():
@@ -671,24 +728,18 @@ def help():
     print('        -p <prefix>                   identifier to be prefixed')
     print('        -s <name>                     output function stubs')
     print('        -v <variable>:<value>[;...]   add user variable')
+    print('        -d                            order declarations by dependency')
+    print('        -i                            remove unused includes')
+    print('\nschemas may be xml, json or binary, see schema.py')
 
 
 def main():
-    global indent
-    global prefix
-    global functions_only
-    global stub_guards_on
-    global stub
-    global stub_includes
-    global stub_prefix
-    global stub_qualifier
-
     if 1 == len(sys.argv):
         help()
         sys.exit(1)
 
     # TODO Add options for outputting header or source files
-    options, arguments = getopt.getopt(sys.argv[1:], 'hp:s:v:fg')
+    options, arguments = getopt.getopt(sys.argv[1:], 'hp:s:v:fgdi')
 
     if 0 == len(arguments):
         raise Exception('missing schema file')
@@ -700,8 +751,15 @@ def main():
     if not path.exists(schema) or not path.isfile(schema):
         raise Exception('invalid schema file:', schema);
 
-    tree = XML.parse(schema)
-    interface = tree.getroot()
+    interface = Schema.load(schema)
+
+    prefix = ''
+    functions_only = False
+    stub = None
+    stub_guards_on = False
+    variables = []
+    order_declarations = False
+    prune_includes = False
 
     for opt, arg in options:
         if opt in ('-h'):
@@ -712,21 +770,7 @@ def main():
                 raise Exception('invalid C prefix:', arg)
             prefix = arg
         elif opt in ('-s'):
-            stubs = interface.find('stubs')
-            for node in stubs:
-                if 'stub' == node.tag:
-                    if arg == node.attrib.get('name'):
-                        stub = node
-                        prefix_stub = node.attrib.get('prefix')
-                        if '' != prefix_stub:
-                            stub_prefix = prefix_stub
-                        qual = node.attrib.get('qualifier')
-                        if '' != qual:
-                            stub_qualifier = qual
-                elif 'include' == node.tag:
-                    stub_includes.append(node.text)
-            if None == stub:
-                raise Exception('could not find stub named:', arg)
+            stub = arg
         elif opt in ('-v'):
             name_end = str(arg).find(':')
             variable = Variable(arg[0:name_end], arg[name_end + 1:].split(';'))
@@ -735,8 +779,17 @@ def main():
             functions_only = True
         elif opt in ('-g'):
             stub_guards_on = True
-
-    generate(interface)
+        elif opt in ('-d'):
+            order_declarations = True
+        elif opt in ('-i'):
+            prune_includes = True
+
+    generator = Generator(prefix = prefix, functions_only = functions_only,
+            stub = stub, stub_guards_on = stub_guards_on,
+            variables = variables, order_declarations = order_declarations,
+            prune_includes = prune_includes)
+    for text in generator.stream(interface):
+        sys.stdout.write(text)
 
 
 if __name__ == '__main__':
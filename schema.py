@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2015 Kenneth Benzie
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.  IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+from __future__ import print_function
+from os import path
+import xml.etree.ElementTree as XML
+import array
+import getopt
+import json
+import sys
+
+
+# Every format describes the same tree of elements, each element has a tag,
+# attributes, text, tail text and an ordered list of child elements. This maps
+# one-to-one onto xml.etree.ElementTree so all emitters work unchanged
+# regardless of which format the schema was loaded from. XML comments are
+# elements with the comment tag, which can not clash with an XML tag name. The
+# XML declaration, processing instructions and anything outside the root
+# element are not part of the tree so they are not preserved.
+formats = ['xml', 'json', 'binary']
+comment_tag = '!'
+
+extensions = {'.xml': 'xml', '.json': 'json', '.bin': 'binary'}
+
+binary_magic = b'APIG'
+binary_version = 1
+
+
+def detect_format(filename, data = None):
+    extension = path.splitext(filename)[1].lower()
+    if extension in extensions:
+        return extensions[extension]
+    if None != data:
+        if data[:len(binary_magic)] == binary_magic:
+            return 'binary'
+        if data.lstrip()[:1] in (b'[', '['):
+            return 'json'
+    return 'xml'
+
+
+# A JSON element is an array of [tag, attributes, text, tail, children...],
+# trailing empty fields are left out and missing attributes, text or tail are
+# null. Positional arrays keep the file small and fast to decode.
+def to_json(node):
+    tag = node.tag
+    if XML.Comment == tag:
+        tag = comment_tag
+    element = [tag, node.attrib or None, node.text, node.tail]
+    element.extend([to_json(child) for child in node])
+    while 1 < len(element) and 4 >= len(element) and None == element[-1]:
+        element.pop()
+    return element
+
+
+# Elements are decoded through a TreeBuilder which joins adjacent text, so
+# skipping a comment joins the text either side of it just as the XML parser
+# does when it is not keeping comments.
+def build_json(builder, element, comments):
+    if not isinstance(element, list) or 0 == len(element):
+        raise Exception('invalid json element:', element)
+    length = len(element)
+    tag = element[0]
+    if comment_tag == tag:
+        if comments:
+            builder.comment(element[2] if 2 < length else None)
+    else:
+        builder.start(tag, element[1] if 1 < length and element[1] else {})
+        if 2 < length and element[2]:
+            builder.data(element[2])
+        for child in element[4:]:
+            build_json(builder, child, comments)
+        builder.end(tag)
+    if 3 < length and element[3]:
+        builder.data(element[3])
+
+
+def from_json(element, comments):
+    builder = XML.TreeBuilder(insert_comments = True)
+    build_json(builder, element, comments)
+    return builder.close()
+
+
+# The binary format is a little endian header of unsigned 32-bit words so it
+# can be decoded in bulk by the array module rather than byte at a time:
+#
+#   magic, version, string count, element word count,
+#   string byte lengths[string count], element words[element word count],
+#   utf-8 string data
+#
+# Strings are stored once and elements refer to them by index, index zero is
+# reserved for a missing text or tail. Each element is written in document
+# order as: tag, attribute count, (key, value) * attribute count, text, tail,
+# child count, followed by its children.
+def intern_string(strings, indices, string):
+    if None == string:
+        return 0
+    if not string in indices:
+        strings.append(string)
+        indices[string] = len(strings)
+    return indices[string]
+
+
+def encode_binary(words, strings, indices, node):
+    tag = node.tag
+    if XML.Comment == tag:
+        tag = comment_tag
+    words.append(intern_string(strings, indices, tag))
+    words.append(len(node.attrib))
+    for key, value in node.attrib.items():
+        words.append(intern_string(strings, indices, key))
+        words.append(intern_string(strings, indices, value))
+    words.append(intern_string(strings, indices, node.text))
+    words.append(intern_string(strings, indices, node.tail))
+    words.append(len(node))
+    for child in node:
+        encode_binary(words, strings, indices, child)
+
+
+def decode_binary(builder, words, offset, strings, comments):
+    tag = strings[words[offset]]
+    count = words[offset + 1]
+    offset += 2
+    attrib = {}
+    for _ in range(count):
+        attrib[strings[words[offset]]] = strings[words[offset + 1]]
+        offset += 2
+    text = strings[words[offset]]
+    tail = strings[words[offset + 1]]
+    count = words[offset + 2]
+    offset += 3
+    if comment_tag == tag:
+        if comments:
+            builder.comment(text)
+    else:
+        builder.start(tag, attrib)
+        if text:
+            builder.data(text)
+        for _ in range(count):
+            offset = decode_binary(builder, words, offset, strings, comments)
+        builder.end(tag)
+    if tail:
+        builder.data(tail)
+    return offset
+
+
+def binary_words(data):
+    words = array.array('I')
+    if 4 != words.itemsize:
+        words = array.array('L')
+    words.frombytes(data)
+    if 'little' != sys.byteorder:
+        words.byteswap()
+    return words
+
+
+def dumps(interface, format = 'xml'):
+    if 'xml' == format:
+        return ('<?xml version="1.0"?>\n' +
+                XML.tostring(interface, encoding = 'unicode') + '\n').encode('utf-8')
+    elif 'json' == format:
+        return json.dumps(to_json(interface), separators = (',', ':'),
+                ensure_ascii = False).encode('utf-8') + b'\n'
+    elif 'binary' == format:
+        strings = []
+        words = binary_words(b'')
+        encode_binary(words, strings, {}, interface)
+        encoded = [string.encode('utf-8') for string in strings]
+        header = binary_words(b'')
+        header.extend([binary_version, len(encoded), len(words)])
+        header.extend([len(string) for string in encoded])
+        header.extend(words)
+        if 'little' != sys.byteorder:
+            header.byteswap()
+        return binary_magic + header.tobytes() + b''.join(encoded)
+    raise Exception('invalid schema format:', format)
+
+
+# Comments are only kept when asked for, the emitters expect the text of an
+# element to be in one piece which a comment in the middle of it would split.
+def loads(data, format = 'xml', comments = False):
+    if 'xml' == format:
+        if comments:
+            return XML.fromstring(data, XML.XMLParser(
+                target = XML.TreeBuilder(insert_comments = True)))
+        return XML.fromstring(data)
+    elif 'json' == format:
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return from_json(json.loads(data), comments)
+    elif 'binary' == format:
+        if data[:len(binary_magic)] != binary_magic:
+            raise Exception('invalid binary schema magic')
+        offset = len(binary_magic)
+        if len(data) < offset + 12:
+            raise Exception('truncated binary schema')
+        header = binary_words(data[offset:offset + 12])
+        if binary_version != header[0]:
+            raise Exception('unsupported binary schema version')
+        offset += 12
+        end = offset + 4 * (header[1] + header[2])
+        if len(data) < end:
+            raise Exception('truncated binary schema')
+        words = binary_words(data[offset:end])
+        strings = [None]
+        for length in words[:header[1]]:
+            if len(data) < end + length:
+                raise Exception('truncated binary schema')
+            strings.append(data[end:end + length].decode('utf-8'))
+            end += length
+        if len(data) != end:
+            raise Exception('trailing data in binary schema')
+        try:
+            builder = XML.TreeBuilder(insert_comments = True)
+            offset = decode_binary(builder, words, header[1], strings,
+                    comments)
+            interface = builder.close()
+        except IndexError:
+            raise Exception('truncated binary schema')
+        if len(words) != offset:
+            raise Exception('trailing data in binary schema')
+        return interface
+    raise Exception('invalid schema format:', format)
+
+
+def load(filename, format = None, comments = False):
+    with open(filename, 'rb') as schema:
+        data = schema.read()
+    if None == format:
+        format = detect_format(filename, data)
+    return loads(data, format, comments)
+
+
+def dump(interface, filename, format = None):
+    if None == format:
+        format = detect_format(filename)
+    with open(filename, 'wb') as schema:
+        schema.write(dumps(interface, format))
+
+
+def help():
+    print('schema.py [options] <input> <output>\n')
+    print('options:')
+    print('        -h                            show this help message')
+    print('        -i <format>                   input format')
+    print('        -o <format>                   output format')
+    print('\nformats: ' + ', '.join(formats) + ', detected from the file ' +
+            'extension when not specified')
+
+
+def main():
+    if 1 == len(sys.argv):
+        help()
+        sys.exit(1)
+
+    options, arguments = getopt.getopt(sys.argv[1:], 'hi:o:')
+
+    input_format = None
+    output_format = None
+    for opt, arg in options:
+        if opt in ('-h'):
+            help()
+            sys.exit(0)
+        elif opt in ('-i'):
+            if not arg in formats:
+                raise Exception('invalid schema format:', arg)
+            input_format = arg
+        elif opt in ('-o'):
+            if not arg in formats:
+                raise Exception('invalid schema format:', arg)
+            output_format = arg
+
+    if 2 != len(arguments):
+        raise Exception('expected input and output schema files')
+    input, output = arguments
+    if not path.exists(input) or not path.isfile(input):
+        raise Exception('invalid schema file:', input);
+
+    dump(load(input, input_format, True), output, output_format)
+
+
+if __name__ == '__main__':
+    main()